@@ -2,10 +2,17 @@
 # -*- coding: utf-8 -*-
 import ast
 import re
+import sys
 
 from setuptools import setup, find_packages
+from setuptools.command.build_ext import build_ext
 from os.path import dirname, join
 
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    cythonize = None
+
 _version_re = re.compile(r'__version__\s+=\s+(.*)')
 
 with open(join(dirname(__file__), 'tomless.py'), 'rb') as f:
@@ -13,14 +20,53 @@ with open(join(dirname(__file__), 'tomless.py'), 'rb') as f:
 
 with open(join(dirname(__file__), 'requirements.txt'), 'rb') as f:
     requires = []
-    for line in f.readlines():
+    for line in f.read().decode('utf-8').splitlines():
         line = line.strip()
-        if not line.startswith('#'):
+        if line and not line.startswith('#'):
             requires.append(line)
+
+
+def warn_fallback(e):
+    sys.stderr.write('WARNING: building the compiled tomless module failed ({}), using the pure python one\n'.format(e))
+
+
+class optional_build_ext(build_ext):
+    '''
+    the compiled tomless module is only a speedup, so a missing or broken
+    C toolchain falls back to the pure python tomless.py instead of failing
+    '''
+    failed = False
+
+    def run(self):
+        try:
+            build_ext.run(self)
+        except Exception as e:
+            # copying the extension a failed build_extension never made
+            # ends up here too, that failure was already reported
+            if not self.failed:
+                warn_fallback(e)
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except Exception as e:
+            self.failed = True
+            warn_fallback(e)
+
+
+ext_modules = []
+if cythonize is not None:
+    try:
+        ext_modules = cythonize(['tomless.py'], compiler_directives={'language_level': 3})
+    except Exception as e:
+        warn_fallback(e)
+
 setup(
     name='TOMLess',
     version=version,
     py_modules=['tomless', ],
+    ext_modules=ext_modules,
+    cmdclass={'build_ext': optional_build_ext},
     # packages=find_packages(exclude=('data', 'log')),
     zip_safe=False,
     entry_points={
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import datetime
+import unittest
+
+from tomless import TomlParser, TomlTokenizer, XmlEncoder, parse_datetime, unescape
+
+
+class ParseDatetimeTest(unittest.TestCase):
+
+    def test_utc(self):
+        self.assertEqual(
+            parse_datetime('1979-05-27T07:32:00Z'),
+            datetime.datetime(1979, 5, 27, 7, 32, 0, tzinfo=datetime.timezone.utc))
+
+    def test_negative_offset_with_colon(self):
+        dt = parse_datetime('1979-05-27T07:32:00-08:00')
+        self.assertEqual(dt.utcoffset(), datetime.timedelta(hours=-8))
+        self.assertEqual(dt, datetime.datetime(1979, 5, 27, 15, 32, 0, tzinfo=datetime.timezone.utc))
+
+    def test_positive_offset_without_colon(self):
+        dt = parse_datetime('1979-05-27T07:32:00+0530')
+        self.assertEqual(dt.utcoffset(), datetime.timedelta(hours=5, minutes=30))
+        self.assertEqual((dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second), (1979, 5, 27, 7, 32, 0))
+
+
+class UnescapeTest(unittest.TestCase):
+
+    def test_toml_escapes(self):
+        cases = (
+            (r'\b', '\b'),
+            (r'\t', '\t'),
+            (r'\n', '\n'),
+            (r'\f', '\f'),
+            (r'\r', '\r'),
+            (r'\"', '"'),
+            (r'\\', '\\'),
+            (r'\u00e9', u'\u00e9'),
+            (r'\U0001F600', u'\U0001F600'),
+        )
+        for escaped, expected in cases:
+            self.assertEqual(unescape('a' + escaped + 'b'), 'a' + expected + 'b')
+
+    def test_escaped_backslash_is_not_reread(self):
+        self.assertEqual(unescape(r'\\n'), '\\n')
+
+    def test_non_toml_escapes_are_kept(self):
+        self.assertEqual(unescape(r'\x41'), r'\x41')
+
+    def test_invalid_unicode_escapes(self):
+        for escaped in (r'\UFFFFFFFF', r'\U00110000', r'\uD800', r'\uDFFF'):
+            with self.assertRaises(ValueError):
+                unescape(escaped)
+
+    def test_non_ascii_text(self):
+        self.assertEqual(unescape(u'例\\t子'), u'例\t子')
+        self.assertEqual(unescape(u'例子'), u'例子')
+
+
+class TokenizeContentTest(unittest.TestCase):
+
+    def test_row_and_col(self):
+        tokens = list(TomlTokenizer.tokenize_content('\na = 1\n  [x.y]\n'))
+        self.assertEqual(
+            [(token.type, token.val, token.row_no, token.col_no) for token in tokens],
+            [
+                ('id', 'a', 2, 0),
+                ('=', '=', 2, 2),
+                ('int', 1, 2, 4),
+                ('section', ('x', 'y'), 3, 2),
+            ])
+
+    def test_comments(self):
+        content = 'a = 1 # one\n# two\n'
+        types = [token.type for token in TomlTokenizer.tokenize_content(content)]
+        self.assertEqual(types, ['id', '=', 'int', 'comment', 'comment'])
+        types = [token.type for token in TomlTokenizer.tokenize_content(content, comments=False)]
+        self.assertEqual(types, ['id', '=', 'int'])
+
+    def test_lex_error(self):
+        with self.assertRaises(Exception) as ctx:
+            list(TomlTokenizer.tokenize_content('a = 1\n  b = 2 @ 3\n'))
+        self.assertEqual(str(ctx.exception), 'lex error at line 2 8:   b = 2 @ 3')
+
+    def test_invalid_unicode_escape_is_lex_error(self):
+        with self.assertRaises(Exception) as ctx:
+            list(TomlTokenizer.tokenize_content('a = 1\nb = "\\uD800"\n'))
+        self.assertEqual(str(ctx.exception), r'lex error at line 2 4: b = "\uD800" (invalid unicode escape \uD800)')
+
+    def test_string_does_not_span_lines(self):
+        for content in ('a = "x\nb = "\n', 'a = "x\nb = 1\n'):
+            with self.assertRaises(Exception) as ctx:
+                TomlParser.parse_content(content)
+            self.assertEqual(str(ctx.exception), 'lex error at line 1 4: a = "x')
+
+
+class ParseContentTest(unittest.TestCase):
+
+    def test_nested_sections(self):
+        result = TomlParser.parse_content('a = 1\n[x.y]\nb = 2\n[x]\nc = [1, [2, 3], []]\n')
+        self.assertEqual(result, {'a': 1, 'x': {'y': {'b': 2}, 'c': [1, [2, 3], []]}})
+
+    def test_empty_sections(self):
+        result = TomlParser.parse_content('[a]\n[b.c]\n[d]\ne = true\n')
+        self.assertEqual(result, {'a': {}, 'b': {'c': {}}, 'd': {'e': True}})
+
+
+class XmlEncoderTest(unittest.TestCase):
+
+    def test_empty_nodes_and_escaping(self):
+        d = {'a': '', 'b': [], 'c': {}, 'd': 'x<&>y', 'e': [[1], []]}
+        self.assertEqual(
+            XmlEncoder(root_tag='toml', item_tag='item').encode(d),
+            '<toml><item><a /><b /><c /><d>x&lt;&amp;&gt;y</d><e><item><item>1</item></item><item /></e></item></toml>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,11 +2,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 import re
+import sys
 import json
 import datetime
 import logging
-from collections import namedtuple
-from dateutil.parser import parse as parse_datetime
+from bisect import bisect_right
+from functools import lru_cache
+from typing import NamedTuple
+from enum import IntEnum
 
 __version__ = '0.1.0'
 __author__ = 'etng <etng2004@gmail.com>'
@@ -15,88 +18,177 @@ __all__ = (
     'TomlParser',
 )
 
-TomlToken = namedtuple('TomlToken', 'type, val, row_no, col_no')
+class TomlToken(NamedTuple):
+    type: str
+    val: object
+    row_no: int
+    col_no: int
+
+# token type sets for the parser's dispatch, interned so membership is a
+# cached hash plus a pointer compare
+_VALUE_TYPES = frozenset(map(sys.intern, ('int', 'float', 'string', 'datetime', 'bool')))
+_TERMINATOR_TYPES = frozenset(map(sys.intern, ('id', ']', 'section', 'eof')))
+# terminators that also start the next key or section
+_RESTART_TYPES = frozenset(map(sys.intern, ('id', 'section')))
+
+_ESCAPE_PATTERN = re.compile(r'\\(?:[btnfr"\\]|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8})')
+_ESCAPE_MAP = {
+    r'\b': '\b',
+    r'\t': '\t',
+    r'\n': '\n',
+    r'\f': '\f',
+    r'\r': '\r',
+    r'\"': '"',
+    r'\\': '\\',
+}
+
+def _unescape_one(match):
+    escaped = match.group(0)
+    if escaped in _ESCAPE_MAP:
+        return _ESCAPE_MAP[escaped]
+    code_point = int(escaped[2:], 16)
+    # only unicode scalar values, no surrogates and nothing past U+10FFFF
+    if code_point > 0x10FFFF or 0xD800 <= code_point <= 0xDFFF:
+        raise ValueError('invalid unicode escape {}'.format(escaped))
+    return chr(code_point)
 
 def unescape(s):
-    escaping_map = (
-        (r'\t', "\t", ),
-        (r'\n', "\n", ),
-        (r'\r', "\r", ),
-    )
-    for src, dst in escaping_map:
-        s = s.replace(src, dst)
-    try:
-        s = s.decode('utf-8')
-    except Exception as e:
-        print(e.message)
-    return s
+    if '\\' not in s:
+        return s
+    # only the escapes toml defines, in a single pass
+    return _ESCAPE_PATTERN.sub(_unescape_one, s)
+
+def parse_datetime(s):
+    '''
+    s is already matched by the datetime pattern, so the fields sit at fixed
+    offsets: YYYY-MM-DDTHH:MM:SS followed by Z or a [-+]HH[:]MM offset
+    '''
+    if s[19] == 'Z':
+        tz = datetime.timezone.utc
+    else:
+        minutes = int(s[20:22]) * 60 + int(s[-2:])
+        tz = datetime.timezone(datetime.timedelta(minutes=-minutes if s[19] == '-' else minutes))
+    return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19]), tzinfo=tz)
 
 class TomlTokenizer(object):
+    # (type, regexp) pairs tried left to right at every offset, the most
+    # common tokens first; datetime before float before int, bool before id
+    # and section before literal so the longer/keyword match wins. only the
+    # whole match is used, so any grouping inside must be (?:...)
     PATTERNS = (
-        ('bool', re.compile('(true|false)'), lambda x: x == 'true'),
-        ('comment', re.compile(r'(#[\s\S]*)'), lambda x: x[1:].strip()),
-        ('id', re.compile(r'([_a-zA-Z][a-zA-Z0-9_]*)'), None),
-        ('section', re.compile(r'(\[[_a-zA-Z][a-zA-Z0-9_]*(\.[_a-zA-Z][a-zA-Z0-9_]*)*\])'), lambda x: x[1:-1].strip()),
-        ('string', re.compile('("[^"]*")'), lambda x: unescape(x[1:-1].strip())),
-        ('whitespace', re.compile('(\s+)'), lambda x: None),
-        ('literal', re.compile(r'([,\[\]=])'), None),
-        ('datetime', re.compile('(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}([-+]\d{2}:?\d{2}|Z))'), lambda x: parse_datetime(x)),
-        ('float', re.compile('(\d+\.\d+)'), lambda x: float(x)),
-        ('int', re.compile('(\d+)'), lambda x: int(x)),
+        ('whitespace', r'\s+'),
+        ('string', r'"[^"\n]*"'),
+        ('datetime', r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:[-+]\d{2}:?\d{2}|Z)'),
+        ('float', r'\d+\.\d+'),
+        ('int', r'\d+'),
+        ('bool', r'true|false'),
+        ('id', r'[_a-zA-Z][a-zA-Z0-9_]*'),
+        ('section', r'\[[_a-zA-Z][a-zA-Z0-9_]*(?:\.[_a-zA-Z][a-zA-Z0-9_]*)*\]'),
+        ('literal', r'[,\[\]=]'),
+        ('comment', r'#[^\n]*'),
     )
+    PROCESSORS = {
+        'bool': lambda x: x == 'true',
+        'comment': lambda x: x[1:].strip(),
+        'section': lambda x: tuple(x[1:-1].split('.')),
+        'string': lambda x: unescape(x[1:-1].strip()),
+        'datetime': lambda x: parse_datetime(x),
+        'float': lambda x: float(x),
+        'int': lambda x: int(x),
+    }
+    # any module with a re compatible compile(), e.g. google-re2's re2 for
+    # linear time matching; set it on a subclass, patterns are cached per class
+    REGEX_MODULE = re
     LOGGER_NAME = 'tomless.tokenizer'
 
+    @classmethod
+    @lru_cache(maxsize=None)
+    def master_pattern(cls):
+        '''
+        compile PATTERNS into one named-group alternation on first use
+        '''
+        master_pattern = cls.REGEX_MODULE.compile('|'.join('(?P<{}>{})'.format(t_type, pattern) for t_type, pattern in cls.PATTERNS))
+        if master_pattern.groups != len(cls.PATTERNS):
+            raise Exception('capturing group in PATTERNS, use (?:...) instead')
+        return master_pattern
+
     @classmethod
     def tokenize_line(cls, line, line_no):
-        offset = 0
-        logger = logging.getLogger(cls.LOGGER_NAME)
-        logger.debug('tokenlizing line {} {}'.format(line_no, line))
-        line = line.strip()
-        while offset < len(line):
-            current_offset = offset
-            for t_type, pattern, processor in cls.PATTERNS:
-                logger.debug('try pattern {} at offset {}'.format(t_type, offset))
-                match = pattern.match(line, offset)
-                if not match:
-                    logger.debug('no match')
-                    continue
-                content = match.group(0)
-                content_length = len(content)
-                val = processor(content) if processor else content
-                if t_type != 'whitespace':
-                    yield TomlToken(val if t_type == 'literal' else t_type, val, line_no, offset)
-                offset += content_length
-                logger.debug('matched pattern {} {} ({})'.format(t_type, content, content_length))
-            if current_offset == offset:
-                raise Exception('lex error at line {} {}: {}'.format(line_no, current_offset, line))
-            logger.debug('check eol:{} {} {}'.format(offset, len(line), line[offset:]))
+        return cls.tokenize_content(line.strip(), line_no)
 
     @classmethod
-    def tokenize_content(cls, content):
-        for i, line in enumerate(content.strip().splitlines()):
-            for token in cls.tokenize_line(line, i+1):
-                yield token
+    def tokenize_content(cls, content, line_no=1, comments=True):
+        '''
+        scan the whole content in a single pass of the master pattern,
+        row and column are only worked out for the tokens yielded;
+        whitespace, and comments unless asked for, never become tokens
+        '''
+        logger = logging.getLogger(cls.LOGGER_NAME)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        skipped_types = frozenset(('whitespace', )) if comments else frozenset(('whitespace', 'comment'))
+        line_starts = [0]
+        line_starts.extend(m.end() for m in re.finditer('\n', content))
+        # locals for everything the loop touches per token
+        intern = sys.intern
+        get_processor = cls.PROCESSORS.get
+        log_debug = logger.debug
+        make_token = TomlToken
+        find_row = bisect_right
+        offset = 0
+        for match in cls.master_pattern().finditer(content):
+            start = match.start()
+            if start != offset:
+                break
+            offset = match.end()
+            t_type = match.lastgroup
+            if t_type in skipped_types:
+                continue
+            t_type = intern(t_type)
+            text = match.group(0)
+            if debug:
+                log_debug('matched pattern %s %s (%s)', t_type, text, len(text))
+            processor = get_processor(t_type)
+            try:
+                val = processor(text) if processor else text
+            except ValueError as e:
+                raise cls._lex_error(content, line_starts, line_no, start, e)
+            row = find_row(line_starts, start)
+            yield make_token(val if t_type == 'literal' else t_type, val, line_no + row - 1, start - line_starts[row-1])
+        if offset < len(content):
+            raise cls._lex_error(content, line_starts, line_no, offset)
+
+    @staticmethod
+    def _lex_error(content, line_starts, line_no, offset, reason=None):
+        row = bisect_right(line_starts, offset)
+        line = content[line_starts[row-1]:].split('\n', 1)[0]
+        message = 'lex error at line {} {}: {}'.format(line_no + row - 1, offset - line_starts[row-1], line)
+        if reason is not None:
+            message = '{} ({})'.format(message, reason)
+        return Exception(message)
 
     @classmethod
     def tokenize_file(cls, filename):
-        content = ''
-        with open(filename) as f:
-            content = f.read()
+        with open(filename, 'rb') as f:
+            content = f.read().decode('utf-8')
         return list(cls.tokenize_content(content))
 
+class ParserStatus(IntEnum):
+    SECTION = 0
+    VALUE = 1
+    LIST = 2
+
 class TomlParser(object):
     LOGGER_NAME = 'tomless.parser'
 
     @classmethod
     def parse_content(cls, content):
-        return cls(list(TomlTokenizer.tokenize_content(content))).parse()
+        return cls(TomlTokenizer.tokenize_content(content, comments=False)).parse()
 
     @classmethod
     def parse_file(cls, filename):
-        content = ''
-        with open(filename) as f:
-            content = f.read()
-        return cls(list(TomlTokenizer.tokenize_content(content))).parse()
+        with open(filename, 'rb') as f:
+            content = f.read().decode('utf-8')
+        return cls(TomlTokenizer.tokenize_content(content, comments=False)).parse()
 
     def __init__(self, tokens):
         self.tokens = tokens
@@ -104,67 +196,72 @@ class TomlParser(object):
         self.context = {}
         self.status_history = []
         self.section_history = []
-        self.token_history = []
+        self.list_starts = []
         self.value_stack = []
         self.logger = logging.getLogger(self.__class__.LOGGER_NAME)
+        self._debug = self.logger.isEnabledFor(logging.DEBUG)
+        self._status = None
+        self._section_name = None
+        self._section_parent = self.result
+        self.var = None
 
-    def __getattr__(self, attr):
-        '''
-        fetch method from current status related class and bind self to it,
-        so all the static method of status class will be treated as the
-        Parser Class's member method
-        '''
-        klass = getattr(self, self._status)
-        meth = getattr(klass, attr, None)
-        if callable(meth):
-            def _(*args, **kwargs):
-                return meth(self, *args, **kwargs)
-            return _
-        return meth
+    def feed(self, token):
+        return self._FEED[self._status](self, token)
+
+    def _on_enter(self, *args, **kwargs):
+        return self._ENTER[self._status](self, *args, **kwargs)
+
+    def _on_exit(self):
+        return self._EXIT[self._status](self)
+
+    def _flush_context(self):
+        return self._FLUSH[self._status](self)
 
     def parse(self):
-        self.logger.debug('parse begin')
-        self.enter('StatusBuildSection', '')
+        if self._debug:
+            self.logger.debug('parse begin')
+        self.enter(ParserStatus.SECTION, ())
+        feed = self.feed
         for token in self.tokens:
-            if token.type in ('comment', ):
+            if token.type == 'comment':
                 continue
-            self.feed(token)
+            feed(token)
         self.feed(TomlToken('eof', '', None, None))
         self.exit()
-        self.logger.debug('parse end, taking snapshot')
-        self.logger.debug('section_history %s', self.section_history)
-        self.logger.debug('status_history %s', self.status_history)
-        self.logger.debug('value_stack %s', self.value_stack)
-        self.logger.debug('parse end, taked snapshot')
+        if self._debug:
+            self.logger.debug('parse end, taking snapshot')
+            self.logger.debug('section_history %s', self.section_history)
+            self.logger.debug('status_history %s', self.status_history)
+            self.logger.debug('value_stack %s', self.value_stack)
+            self.logger.debug('parse end, taked snapshot')
         return self.result
 
     def exit(self):
         current_status = self.status_history.pop()
-        self.logger.debug('exiting status %s, %s', current_status, current_status == self._status)
+        if self._debug:
+            self.logger.debug('exiting status %s, %s', current_status, current_status == self._status)
         self._on_exit()
         if self.status_history:
             last_status = self.status_history.pop()
-            self.logger.debug('reenter status %s', last_status)
+            if self._debug:
+                self.logger.debug('reenter status %s', last_status)
             self.enter(last_status)
 
     def enter(self, status, *args, **kwargs):
         self._status = status
         self.status_history.append(status)
-        self.logger.debug('before _on_enter %s %s %s', status, args, kwargs)
+        if self._debug:
+            self.logger.debug('before _on_enter %s %s %s', status, args, kwargs)
         self._on_enter(*args, **kwargs)
 
-    def combine_values(self, stop_type=None):
-        if stop_type:
-            self.logger.debug('combine values until meet type {}'.format(stop_type))
-            vals = []
-            while True:
-                val = self.value_stack.pop()
-                self.logger.debug('found val {} {}'.format(val.type, val.val))
-                if val.type == stop_type:
-                    self.logger.debug('stopped now {}'.format(val))
-                    break
-                vals.append(val.val)
-            return TomlToken('list', list(reversed(vals)), None, None)
+    def combine_values(self, start=None):
+        if start is not None:
+            # value_stack[start] is the opening [ of the list, its items follow
+            if self._debug:
+                self.logger.debug('combine values from %s', start)
+            vals = [val.val for val in self.value_stack[start+1:]]
+            del self.value_stack[start:]
+            return TomlToken('list', vals, None, None)
         else:
             val = self.value_stack.pop()
             return val
@@ -180,74 +277,89 @@ class TomlParser(object):
         def _on_exit(self, *args, **kwargs):
             pass
 
+        @staticmethod
+        def feed(self, token):
+            pass
+
+        @staticmethod
+        def _flush_context(self):
+            pass
+
     class StatusBuildSection(StatusBase):
 
         @staticmethod
-        def sync_result(self, section_name):
-            self.logger.debug('before sync_result %s %s', section_name, self.context)
+        def _flush_context(self):
+            '''
+            move the pending key/values into the dict of the current section
+            '''
+            if self._debug:
+                self.logger.debug('before _flush_context %s %s', self._section_name, self.context)
             if not self.context:
-                self.logger.debug('no context, ignore sync_result')
+                if self._debug:
+                    self.logger.debug('no context, ignore _flush_context')
                 return
-            if section_name:
-                parent = self.result
-                parts = section_name.split('.')
-                for part in parts:
-                    parent.setdefault(part, {})
-                    parent = parent[part]
-                parent.update(self.context)
-            else:
-                self.result.update(self.context)
+            self._section_parent.update(self.context)
             self.context = {}
-            self.logger.debug('after sync_result %s %s %s', section_name, self.result, self.context)
+            if self._debug:
+                self.logger.debug('after _flush_context %s %s %s', self._section_name, self.result, self.context)
 
         @staticmethod
         def _on_enter(self, name=None, *args, **kwargs):
-            self.sync_result(self._section_name)
+            self._flush_context()
             if name is None and self.section_history:
+                # back from a value, the section and its dict are unchanged
                 name = self.section_history.pop()
+            else:
+                parent = self.result
+                for part in name:
+                    parent = parent.setdefault(part, {})
+                self._section_parent = parent
             self.section_history.append(name)
             self._section_name = name
-            self.logger.debug('current result %s', self.result)
-            self.logger.debug('in section {}'.format(name if name else 'ROOT'))
+            if self._debug:
+                self.logger.debug('current result %s', self.result)
+                self.logger.debug('in section %s', '.'.join(name) if name else 'ROOT')
 
         @staticmethod
         def feed(self, token):
-            if token.type in ('id', ):
+            if token.type == 'id':
                 self.var = token.val
-            elif token.type in ('=', ):
-                self.enter('StatusBuildValue')
-            elif token.type in ('section', ):
-                self.enter('StatusBuildSection', token.val)
+            elif token.type == '=':
+                self.enter(ParserStatus.VALUE)
+            elif token.type == 'section':
+                self.enter(ParserStatus.SECTION, token.val)
             else:
                 self.logger.error('unknown token %s %s', token.type, token.val)
 
         @staticmethod
         def _on_exit(self):
-            self.sync_result(self._section_name)
+            self._flush_context()
 
 
     class StatusBuildValue(StatusBase):
 
         @staticmethod
         def _on_enter(self, *args, **kwargs):
-            self.logger.debug('build value for %s', self.var)
+            if self._debug:
+                self.logger.debug('build value for %s', self.var)
             pass
 
         @staticmethod
         def feed(self, token):
-            if token.type in ('id', ']', 'section', 'eof', ):
+            if token.type in _TERMINATOR_TYPES:
                 self.exit()
-                if token.type in ('id', 'section', ):
+                if token.type in _RESTART_TYPES:
                     self.feed(token)
                 # if token.type == 'id':
                 #     self.var = token.val
                 # elif token.type == 'section':
-                #     self.enter('StatusBuildSection', token.val)
-            elif token.type in ('int', 'float', 'string', 'datetime', 'bool', ):
-                self.logger.debug('push value stack: %s', token)
+                #     self.enter(ParserStatus.SECTION, token.val)
+            elif token.type in _VALUE_TYPES:
+                if self._debug:
+                    self.logger.debug('push value stack: %s', token)
                 self.value_stack.append(token)
-            elif token.type in ('[', ):
-                self.enter('StatusBuildList', token)
+            elif token.type == '[':
+                self.enter(ParserStatus.LIST, token)
             else:
                 self.logger.error('unknown value: %s %s', token.type, token.val)
 
@@ -255,7 +367,8 @@ class TomlParser(object):
         def _on_exit(self):
             if self.value_stack:
                 val = self.combine_values()
-                self.logger.debug('assign: %s = %s', self.var, val.val)
+                if self._debug:
+                    self.logger.debug('assign: %s = %s', self.var, val.val)
                 self.context[self.var] = val.val
             else:
                 self.logger.error('empty value stack for var %s', self.var)
@@ -265,37 +378,49 @@ class TomlParser(object):
 
         @staticmethod
         def _on_enter(self, token=None, *args, **kwargs):
-            self.logger.debug('building list')
-            if token is None:
-                if self.token_history:
-                    token = self.token_history.pop()
-            else:
-                self.token_history.append(token)
+            if self._debug:
+                self.logger.debug('building list')
+            if token is not None:
+                self.list_starts.append(len(self.value_stack))
                 self.value_stack.append(token)
 
         @staticmethod
         def feed(self, token):
-            if token.type in (',', ):
-                self.logger.debug('pass list ,')
+            if token.type == ',':
+                if self._debug:
+                    self.logger.debug('pass list ,')
                 pass
-            elif token.type in ('[', ):
-                self.logger.debug('list in list')
-                self.logger.debug('enter list now %s', token)
-                self.enter('StatusBuildList', token)
-            elif token.type in (']', ):
-                self.logger.debug('exit list on ]')
+            elif token.type == '[':
+                if self._debug:
+                    self.logger.debug('list in list')
+                    self.logger.debug('enter list now %s', token)
+                self.enter(ParserStatus.LIST, token)
+            elif token.type == ']':
+                if self._debug:
+                    self.logger.debug('exit list on ]')
                 self.exit()
-            elif token.type in ('int', 'float', 'string', 'datetime', 'bool', ):
-                self.logger.debug('got list value %s', token.val)
+            elif token.type in _VALUE_TYPES:
+                if self._debug:
+                    self.logger.debug('got list value %s', token.val)
                 self.value_stack.append(token)
             else:
-                self.logger.debug('list unknown: %s %s', token.type, token.val)
+                if self._debug:
+                    self.logger.debug('list unknown: %s %s', token.type, token.val)
 
         @staticmethod
         def _on_exit(self):
-            val = self.combine_values('[')
+            val = self.combine_values(self.list_starts.pop())
             self.value_stack.append(val)
-            self.logger.debug('found list %s', val)
+            if self._debug:
+                self.logger.debug('found list %s', val)
+
+    # static methods of each status class indexed by ParserStatus, called
+    # with the parser as self so they act as the parser's own member methods
+    _STATUSES = (StatusBuildSection, StatusBuildValue, StatusBuildList)
+    _FEED = tuple(klass.feed for klass in _STATUSES)
+    _ENTER = tuple(klass._on_enter for klass in _STATUSES)
+    _EXIT = tuple(klass._on_exit for klass in _STATUSES)
+    _FLUSH = tuple(klass._flush_context for klass in _STATUSES)
 
 class MyJsonEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -304,33 +429,43 @@ class MyJsonEncoder(json.JSONEncoder):
         else:
             return json.JSONEncoder.default(self, obj)
 
-from xml.etree import ElementTree as Tree
+def escape_xml(s):
+    # same as xml.sax.saxutils.escape, whose import alone pulls in urllib
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
 
 class XmlEncoder(object):
     '''
     >>> d = dict(a=1, b=u'hello world', c=[1,2,3,4])
-    >>> print XmlEncoder(root_tag='toml', item_tag='item').encode(d)
-    <toml><item><a>1</a><c><item>1</item><item>2</item><item>3</item><item>4</item></c><b>hello world</b></item></toml>
+    >>> print(XmlEncoder(root_tag='toml', item_tag='item').encode(d))
+    <toml><item><a>1</a><b>hello world</b><c><item>1</item><item>2</item><item>3</item><item>4</item></c></item></toml>
     '''
     def __init__(self, root_tag='root', item_tag='item'):
         self.root_tag = root_tag
         self.item_tag = item_tag
 
     def encode(self, v):
-        root = Tree.Element(self.root_tag)
-        self.encode_node(root, v)
-        return Tree.tostring(root)
-
-    def encode_node(self, parent, v, k=None):
-        child = Tree.SubElement(parent, self.item_tag if k is None else k)
+        buf = ['<' + self.root_tag + '>']
+        self.encode_node(buf, v)
+        buf.append('</' + self.root_tag + '>')
+        return ''.join(buf)
+
+    def encode_node(self, buf, v, k=None):
+        tag = self.item_tag if k is None else k
+        children = ()
+        text = ''
         if isinstance(v, dict):
-            for k, _v in v.items():
-                self.encode_node(child, _v, k)
+            children = v.items()
         elif isinstance(v, (tuple, list)):
-            for _v in v:
-                self.encode_node(child, _v)
+            children = [(None, _v) for _v in v]
         else:
-            child.text = unicode(v)
+            text = escape_xml(str(v))
+        if not children and not text:
+            buf.append('<' + tag + ' />')
+            return
+        buf.append('<' + tag + '>' + text)
+        for _k, _v in children:
+            self.encode_node(buf, _v, _k)
+        buf.append('</' + tag + '>')
 
 
 def selftest():
@@ -357,7 +492,7 @@ def print_or_save(filename, content):
         print(content)
         return
     with open(filename, 'wb') as f:
-        f.write(content)
+        f.write(content.encode('utf-8'))
 
 def execute():
     all_log_level = logging.DEBUG